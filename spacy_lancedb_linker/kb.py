@@ -4,13 +4,23 @@ Adapted from:
 - https://github.com/explosion/spaCy/blob/master/spacy/kb/kb_in_memory.pyx
 """
 
+import functools
+import hashlib
+import math
+import threading
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Iterable
 
 import lancedb
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import torch
 from lancedb.embeddings import get_registry
 from lancedb.pydantic import LanceModel, Vector
 from lancedb.rerankers import CrossEncoderReranker
+from lancedb.table import Table
 from pydantic import create_model
 from spacy.tokens import Span
 
@@ -18,6 +28,14 @@ from spacy_lancedb_linker.types import Alias, Entity
 
 FAST_AND_SMALL = "sentence-transformers/all-MiniLM-L6-v2"
 
+# below this many vectors, a brute-force scan is both exact and faster than
+# an IVF index (which also needs enough rows to train its partitions)
+ANN_MIN_VECTORS = 256
+
+# below this many aliases, a single BLAS matrix-vector product over an
+# in-memory copy of the vectors beats the LanceDB query planner + scan
+IN_MEMORY_MAX_VECTORS = 50_000
+
 
 @dataclass
 class AnnKnowledgeBase:
@@ -25,6 +43,12 @@ class AnnKnowledgeBase:
     # Parameters for the mention candidate generation
     top_k: int = 10
     max_distance: float = 0.5
+    # Precision of the encoder weights: "fp32" (default), "fp16" or "bf16".
+    # Halving the weight width halves memory traffic in the transformer
+    # forward pass; fp16 is mainly worthwhile on GPU, bf16 on recent CPUs.
+    precision: str = "fp32"
+    # Device for the encoder; None picks cuda, then mps, then cpu.
+    device: str | None = None
 
     def __post_init__(self) -> None:
         """Create an AnnKnowledgeBase."""
@@ -34,11 +58,30 @@ class AnnKnowledgeBase:
         # Embedding model for aliases and entities
         # any LanceDB-compatible model is available as a drop-in replacement
         # ref: https://lancedb.github.io/lancedb/embeddings/default_embedding_functions/#text-embedding-functions
+        if self.device is None:
+            self.device = (
+                "cuda"
+                if torch.cuda.is_available()
+                else "mps"
+                if torch.backends.mps.is_available()
+                else "cpu"
+            )
         self.encoder = (
             get_registry()
             .get("sentence-transformers")
-            .create(name=FAST_AND_SMALL, device="cpu")
+            .create(name=FAST_AND_SMALL, device=self.device)
         )
+        if self.precision not in ("fp32", "fp16", "bf16"):
+            raise ValueError(f"Unknown precision {self.precision!r}")
+        # hold a strong reference to the SentenceTransformer: lancedb serves
+        # encoder.embedding_model from a process-wide maxsize-1 weak cache,
+        # so a second AnnKnowledgeBase would evict it and the next encoder
+        # call would reload fresh fp32 weights, silently dropping the cast
+        self._embedding_model = self.encoder.embedding_model
+        if self.precision != "fp32":
+            self._embedding_model.to(
+                torch.float16 if self.precision == "fp16" else torch.bfloat16
+            )
 
         # we need pydantic classes to define the Arrow schemas of LanceDB tables.
         # those tables will contain the embedding from our encoder to do the ANN search.
@@ -58,154 +101,445 @@ class AnnKnowledgeBase:
             vector=(Vector(self.encoder.ndims()), self.encoder.VectorField()),
         )
 
+        # memoize single-text embeddings per instance: the same mention or
+        # sentence is often embedded several times (e.g. sibling entities
+        # sharing a sentence), and a cache hit skips the transformer entirely.
+        # the cache is built in __post_init__ (rather than decorating the
+        # method) so it is not shared across instances with different encoders.
+        self._embed_cached = functools.lru_cache(maxsize=4096)(self._embed_uncached)
+
         self._initialize_db()
 
-    def _embed(self, text: str) -> list[int]:
-        return self.encoder.generate_embeddings([text])[0]
+    def _generate_embeddings(self, texts: list[str]) -> list[list[float]]:
+        # the same call encoder.generate_embeddings makes, but through our
+        # strong model reference so the precision cast survives evictions
+        # from lancedb's weak model cache
+        return self._embedding_model.encode(
+            list(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=self.encoder.normalize,
+        ).tolist()
+
+    def _embed_uncached(self, text: str) -> tuple[float, ...]:
+        return tuple(self._generate_embeddings([text])[0])
+
+    def _embed(self, text: str) -> list[float]:
+        return list(self._embed_cached(text))
+
+    def _embed_many(
+        self, texts: list[str], batch_size: int = 64
+    ) -> list[list[float]]:
+        """Embed texts in batches, amortizing the model dispatch overhead.
+
+        One call to the encoder per batch lets SentenceTransformer pad and
+        process the whole batch in a single forward pass, instead of paying
+        the tokenizer/model overhead once per text.
+        """
+        vectors: list[list[float]] = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(self._generate_embeddings(texts[start : start + batch_size]))
+        return vectors
 
     def _initialize_db(self) -> None:
-        # TODO: do better, use mode from params: e.g. the table might already exists
-        self.db.create_table("aliases", schema=self.LanceAlias, mode="overwrite")
-        self.db.create_table("entities", schema=self.LanceEntity, mode="overwrite")
+        # reuse the tables persisted at self.uri when they exist, so a
+        # restart doesn't throw away embeddings computed on a previous run.
+        # cache the table handles so the hot query path doesn't re-read
+        # table metadata on every open_table call
+        existing = set(self.db.table_names())
+        self._aliases_tbl = (
+            self.db.open_table("aliases")
+            if "aliases" in existing
+            else self.db.create_table("aliases", schema=self.LanceAlias)
+        )
+        self._entities_tbl = (
+            self.db.open_table("entities")
+            if "entities" in existing
+            else self.db.create_table("entities", schema=self.LanceEntity)
+        )
+        # in-memory mirror of the alias vectors for small corpora,
+        # L2-normalized so cosine similarity reduces to a dot product
+        self._alias_matrix: np.ndarray | None = None
+        self._alias_meta: list[Alias] = []
+        # whether add_entities ran without the FTS index being rebuilt yet;
+        # the lock serializes index builds when disambiguate runs in threads
+        self._fts_dirty = False
+        self._fts_lock = threading.Lock()
+
+    @functools.cached_property
+    def _reranker(self) -> CrossEncoderReranker:
+        """Load the cross-encoder once per KB instead of once per query.
+
+        entity.name doesn't work because pyarrow changed pa.Table logic from
+        pyarrow.Schema.field_by_name to pyarrow.Schema.field which doesn't
+        support struct fields.
+        """
+        return CrossEncoderReranker(column="entity.name")
+
+    def _fingerprint_path(self, table_name: str) -> Path:
+        return Path(self.uri) / f".{table_name}.fingerprint"
+
+    @staticmethod
+    def _fingerprint(keys: list[str]) -> str:
+        return hashlib.blake2b("\n".join(sorted(keys)).encode("utf-8")).hexdigest()
+
+    def _is_fresh(self, table_name: str, fingerprint: str) -> bool:
+        """Whether the persisted table was already built from the same inputs."""
+        path = self._fingerprint_path(table_name)
+        return path.exists() and path.read_text() == fingerprint
 
     def add_aliases(self, aliases: list[Alias]) -> None:
-        """Build the ANN index of aliases in LanceDB."""
-        table = self.db.open_table("aliases")
-        table.add(
+        """Build the ANN index of aliases in LanceDB.
+
+        Each call replaces the whole aliases table, so pass the full alias
+        corpus at once. If the persisted table was already built from the
+        same aliases (tracked by a sidecar fingerprint file), skip
+        re-embedding entirely.
+        """
+        # fingerprint the fully serialized rows: a change to any field
+        # (e.g. an alias's entities list) must invalidate the persisted table
+        fingerprint = self._fingerprint([alias.model_dump_json() for alias in aliases])
+        if self._is_fresh("aliases", fingerprint):
+            # warm start: repopulate the in-memory mirror from the persisted
+            # table so queries take the same fast path (and return the same
+            # scores) as on the run that built the table
+            if self._alias_matrix is None:
+                self._load_alias_mirror()
+            return
+        self._aliases_tbl = self.db.create_table(
+            "aliases", schema=self.LanceAlias, mode="overwrite"
+        )
+        vectors = self._embed_many([alias.alias for alias in aliases])
+        self._aliases_tbl.add(
             [
-                self.LanceAlias(alias=alias, vector=self._embed(alias.alias))
-                for alias in aliases
+                self.LanceAlias(alias=alias, vector=vector)
+                for alias, vector in zip(aliases, vectors)
             ]
         )
+        self._maybe_create_vector_index(self._aliases_tbl)
+        # keep the in-memory mirror in sync for the small-corpus fast path
+        # (the table was just rebuilt, so the mirror is reset, not extended);
+        # above the threshold every query goes to LanceDB, so don't hold a
+        # second copy of the vectors in memory
+        if len(aliases) <= IN_MEMORY_MAX_VECTORS:
+            normalized = np.asarray(vectors, dtype=np.float32)
+            normalized /= np.linalg.norm(normalized, axis=1, keepdims=True)
+            self._alias_matrix = normalized
+            self._alias_meta = list(aliases)
+        else:
+            self._alias_matrix = None
+            self._alias_meta = []
+        self._fingerprint_path("aliases").write_text(fingerprint)
+
+    def _load_alias_mirror(self) -> None:
+        """Rebuild the in-memory alias mirror from the persisted aliases table.
+
+        Skipped for corpora above IN_MEMORY_MAX_VECTORS: those queries go to
+        LanceDB anyway, so materializing the full table at startup would only
+        cost memory and boot time.
+        """
+        if self._aliases_tbl.count_rows() > IN_MEMORY_MAX_VECTORS:
+            return
+        batch = self._aliases_tbl.to_arrow()
+        if not len(batch):
+            return
+        vectors = np.asarray(batch.column("vector").to_pylist(), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        self._alias_matrix = vectors
+        self._alias_meta = [
+            Alias.model_construct(**alias)
+            for alias in batch.column("alias").to_pylist()
+        ]
+
+    def _maybe_create_vector_index(self, table: Table) -> None:
+        """Build an ANN (IVF_PQ) index on the vector column once the table is big enough.
+
+        Without an index, LanceDB falls back to an exact brute-force scan,
+        which is O(N) per query. Fine (and exact) for small tables, hence the
+        ANN_MIN_VECTORS gate, but sub-linear search pays off at scale.
+        ref: https://lancedb.github.io/lancedb/ann_indexes/
+        """
+        num_rows = table.count_rows()
+        if num_rows < ANN_MIN_VECTORS:
+            return
+        table.create_index(
+            metric="cosine",
+            num_partitions=int(math.sqrt(num_rows)),
+            num_sub_vectors=16,
+            vector_column_name="vector",
+            replace=True,
+        )
 
     def get_candidates_batch(
-        self, mentions: Iterable[Span]
+        self,
+        mentions: Iterable[Span],
+        vectors: list[list[float]] | None = None,
     ) -> Iterable[list[tuple[Alias, float]]]:
-        return [self.get_candidates(span) for span in mentions]
+        """Embed all mention texts in one batch, then search each against the aliases index.
+
+        Texts are sorted by length before embedding so that similarly-sized
+        texts share a batch, minimizing the padding the encoder has to process.
+        Results are scattered back into the original mention order.
+
+        Callers that already embedded the mentions (e.g. as part of a larger
+        batch) can pass the vectors to skip the embedding pass entirely.
+        """
+        texts = [span.text for span in mentions]
+        if vectors is not None:
+            return [self._search_alias_by_vector(vector) for vector in vectors]
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embedded = self._embed_many([texts[i] for i in order])
+        results: list[list[tuple[Alias, float]]] = [[] for _ in texts]
+        for position, vector in zip(order, embedded):
+            results[position] = self._search_alias_by_vector(vector)
+        return results
 
     def get_candidates(self, mention: Span) -> list[tuple[Alias, float]]:
         return self.get_alias_candidates(mention.text)
 
     def get_alias_candidates(self, query: str) -> list[tuple[Alias, float]]:
         """Embed a mention query, search ANN neighbours against the aliases index."""
-        table = self.db.open_table("aliases")
+        return self._search_alias_by_vector(self._embed(query))
+
+    def _search_alias_by_vector(
+        self, vector: list[float]
+    ) -> list[tuple[Alias, float]]:
+        if (
+            self._alias_matrix is not None
+            and len(self._alias_meta) <= IN_MEMORY_MAX_VECTORS
+        ):
+            return self._search_alias_in_memory(vector)
+        # unpack the Arrow result columns directly instead of materializing
+        # every row as a nested Python dict via to_list()
         results = (
-            table.search(self._embed(query))
+            self._aliases_tbl.search(vector)
             .metric("cosine")
             .limit(self.top_k)
             .select(["alias"])
-            .to_list()
+            .to_arrow()
         )
-        filtered_results = [
-            r for r in results if abs(r["_distance"]) < self.max_distance
+        # rows coming back from the schema-typed table are already valid,
+        # so model_construct skips the pydantic validation pass
+        return [
+            (Alias.model_construct(**alias), abs(distance))
+            for alias, distance in zip(
+                results.column("alias").to_pylist(),
+                results.column("_distance").to_pylist(),
+            )
+            if abs(distance) < self.max_distance
         ]
+
+    def _search_alias_in_memory(
+        self, vector: list[float]
+    ) -> list[tuple[Alias, float]]:
+        """Exact cosine top-k over the in-memory alias matrix.
+
+        At small corpus sizes, a single BLAS matrix-vector product plus
+        argpartition is orders of magnitude cheaper than going through the
+        LanceDB query planner and scan.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        similarities = self._alias_matrix @ query
+        top_k = min(self.top_k, len(similarities))
+        indices = np.argpartition(-similarities, top_k - 1)[:top_k]
+        indices = indices[np.argsort(-similarities[indices])]
         return [
-            (Alias(**result["alias"]), abs(result["_distance"]))
-            for result in filtered_results
+            (self._alias_meta[i], abs(float(1.0 - similarities[i])))
+            for i in indices
+            if abs(1.0 - similarities[i]) < self.max_distance
         ]
 
+    @staticmethod
+    def _candidates_filter(candidate_entities: list[str]) -> str:
+        """Build the SQL prefilter restricting a search to the candidate entities.
+
+        An IN clause over entity.entity_id lets DataFusion use a hash lookup
+        per row, instead of evaluating list_has against a re-parsed Python
+        list literal.
+        """
+        ids = ",".join(repr(entity_id) for entity_id in candidate_entities)
+        return f"entity.entity_id IN ({ids})"
+
     def _aliases_to_entities(self, aliases: list[tuple[Alias, float]]) -> list[str]:
+        if len(aliases) > 8:
+            # for large candidate fans, flatten + unique in Arrow is a single
+            # C loop instead of a Python double-loop.
+            # pc.unique keeps first-occurrence order, like dict.fromkeys below
+            entities = pa.array(
+                [alias.entities for alias, _score in aliases],
+                type=pa.list_(pa.string()),
+            )
+            return pc.unique(pc.list_flatten(entities)).to_pylist()
+        # dict.fromkeys dedups while keeping the entities of the
+        # best-scoring aliases first
         return list(
-            set(entity_id for alias, _score in aliases for entity_id in alias.entities)
+            dict.fromkeys(
+                entity_id for alias, _score in aliases for entity_id in alias.entities
+            )
         )
 
     def get_entity_candidates(self, query: str) -> list[str]:
         """Get the entity IDs corresponding to a mention."""
         return self._aliases_to_entities(aliases=self.get_alias_candidates(query))
 
+    def get_entity_by_id(self, entity_id: str) -> Entity | None:
+        """Point-lookup of a single entity by its ID, without any embedding."""
+        results = (
+            self._entities_tbl.search()
+            .where(f"entity.entity_id = {entity_id!r}")
+            .limit(1)
+            .select(["entity"])
+            .to_arrow()
+        )
+        entities = results.column("entity").to_pylist()
+        return Entity.model_construct(**entities[0]) if entities else None
+
     def add_entities(self, entities: list[Entity]) -> None:
-        """Build the ANN index of entities in LanceDB."""
-        table = self.db.open_table("entities")
-        table.add(
+        """Build the ANN index of entities in LanceDB.
+
+        Each call replaces the whole entities table, so pass the full entity
+        corpus at once. If the persisted table was already built from the
+        same entities (tracked by a sidecar fingerprint file), skip
+        re-embedding entirely.
+        """
+        # fingerprint the fully serialized rows: a change to any field
+        # (e.g. an entity's name or description) must invalidate the table
+        fingerprint = self._fingerprint(
+            [entity.model_dump_json() for entity in entities]
+        )
+        if self._is_fresh("entities", fingerprint):
+            return
+        self._entities_tbl = self.db.create_table(
+            "entities", schema=self.LanceEntity, mode="overwrite"
+        )
+        # the overwrite does not touch the FTS index directory, which would
+        # otherwise keep serving the previous table's names
+        self._invalidate_fts_index()
+        # TODO: add option for when the entity description is not available
+        vectors = self._embed_many([entity.description for entity in entities])
+        self._entities_tbl.add(
             [
-                # TODO: add option for when the entity description is not available
-                self.LanceEntity(entity=entity, vector=self._embed(entity.description))
-                for entity in entities
+                self.LanceEntity(entity=entity, vector=vector)
+                for entity, vector in zip(entities, vectors)
             ]
         )
-        # Create a full-text-search index, ref: https://lancedb.github.io/lancedb/fts/
-        table.create_fts_index("entity.name", replace=True)
+        self._maybe_create_vector_index(self._entities_tbl)
+        # defer the full-text-search index build to finalize(), so the load
+        # phase doesn't block on it and the rebuild happens once
+        self._fts_dirty = True
+        self._fingerprint_path("entities").write_text(fingerprint)
+
+    def _invalidate_fts_index(self) -> None:
+        """Delete the on-disk FTS index built against a previous table version."""
+        path, fs, exists = self._entities_tbl._get_fts_index_path()
+        if exists:
+            fs.delete_dir(path)
+
+    def _has_fts_index(self) -> bool:
+        # lancedb 0.13 returns (path, filesystem, exists) for the local FTS
+        # index; this is the same check its FTS search performs
+        _path, _fs, exists = self._entities_tbl._get_fts_index_path()
+        return bool(exists)
+
+    def finalize(self) -> None:
+        """Build the full-text-search index on the entities table.
+
+        Also invoked lazily before the first FTS query, so callers that skip
+        the explicit load-phase finalize still get a valid index. The on-disk
+        index state is checked as well as the dirty flag: on a warm start the
+        previous process may have loaded the tables without ever building it.
+        ref: https://lancedb.github.io/lancedb/fts/
+        """
+        if not self._fts_dirty and self._has_fts_index():
+            return
+        with self._fts_lock:
+            # re-check under the lock: another thread may have built it
+            if not self._fts_dirty and self._has_fts_index():
+                return
+            self._entities_tbl.create_fts_index("entity.name", replace=True)
+            self._fts_dirty = False
 
     def disambiguate(
         self,
         candidate_entities: list[str],
-        context_embedding: list[int],
+        context_text: str,
         text_query: str,
     ) -> list[tuple[Entity, float]]:
-        """Disambiguate candidate entities by getting the most similar to the context in the doc."""
-        table = self.db.open_table("entities")
+        """Disambiguate candidate entities by getting the most similar to the context in the doc.
+
+        The context is only embedded when the full-text search misses, so the
+        common FTS-hit path skips a transformer forward pass.
+        """
+        self.finalize()
+        table = self._entities_tbl
         # we do a sort of hybrid search between:
         #   - full-text-search on entity names
         #   - vector search on the ANN index by the embedding of the context in the doc
         # ref: https://lancedb.github.io/lancedb/hybrid_search/hybrid_search/
         # ref: https://lancedb.github.io/lancedb/reranking/
         entities_results = (
-            table.search(text_query, query_type="fts").select(["entity"]).to_list()
+            table.search(text_query, query_type="fts").select(["entity"]).to_arrow()
         )
         if len(entities_results):
             cosine_score = 0
             return [
-                (Entity(**result["entity"]), cosine_score)
-                for result in entities_results
+                (Entity.model_construct(**entity), cosine_score)
+                for entity in entities_results.column("entity").to_pylist()
             ]
         else:
             entities_results = (
-                table.search(context_embedding)
+                table.search(self._embed(context_text))
                 .metric("cosine")
                 # prefilter for only the candidate entities
-                # here we use a DataFusion function: https://lancedb.github.io/lancedb/sql/#sql-filters
-                # list_has: https://datafusion.apache.org/user-guide/sql/scalar_functions.html#list-has
-                .where(
-                    f"list_has({candidate_entities}, entity.entity_id)", prefilter=True
-                )
+                # ref: https://lancedb.github.io/lancedb/sql/#sql-filters
+                .where(self._candidates_filter(candidate_entities), prefilter=True)
                 # get the top_k
                 .limit(self.top_k)
                 # serialize
                 .select(["entity"])
-                .to_list()
+                .to_arrow()
             )
             return [
-                (Entity(**result["entity"]), abs(result["_distance"]))
-                for result in entities_results
+                (Entity.model_construct(**entity), abs(distance))
+                for entity, distance in zip(
+                    entities_results.column("entity").to_pylist(),
+                    entities_results.column("_distance").to_pylist(),
+                )
             ]
 
     def _disambiguate(
         self,
         candidate_entities: list[str],
-        context_embedding: list[int],
+        context_text: str,
         text_query: str,
     ) -> list[tuple[Entity, float]]:
         """We do a multi-vector reranking.
 
         ref: https://lancedb.github.io/lancedb/reranking/#multi-vector-reranking
         """
-        table = self.db.open_table("entities")
+        table = self._entities_tbl
 
         direct = (
             table.search(self._embed(text_query))
             # prefilter for only the candidate entities
-            # here we use a DataFusion function: https://lancedb.github.io/lancedb/sql/#sql-filters
-            # list_has: https://datafusion.apache.org/user-guide/sql/scalar_functions.html#list-has
-            .where(f"list_has({candidate_entities}, entity.entity_id)", prefilter=True)
+            # ref: https://lancedb.github.io/lancedb/sql/#sql-filters
+            .where(self._candidates_filter(candidate_entities), prefilter=True)
             # get the top_k
             .limit(self.top_k)
         )
 
         context = (
-            table.search(context_embedding)
+            table.search(self._embed(context_text))
             .metric("cosine")
             # prefilter for only the candidate entities
-            # here we use a DataFusion function: https://lancedb.github.io/lancedb/sql/#sql-filters
-            # list_has: https://datafusion.apache.org/user-guide/sql/scalar_functions.html#list-has
-            .where(f"list_has({candidate_entities}, entity.entity_id)", prefilter=True)
+            # ref: https://lancedb.github.io/lancedb/sql/#sql-filters
+            .where(self._candidates_filter(candidate_entities), prefilter=True)
             # get the top_k
             .limit(self.top_k)
         )
 
-        # entity.name doesn't work because pyarrow changed pa.Table logic from pyarrow.Schema.field_by_name to pyarrow.Schema.field which doesn't support struct fields
-        reranker = CrossEncoderReranker(column="entity.name")
         entities_results = (
-            reranker.rerank_multivector(
+            self._reranker.rerank_multivector(
                 vector_results=[direct, context], query=None, deduplicate=True
             )
             # serialize
@@ -213,7 +547,7 @@ class AnnKnowledgeBase:
             .to_list()
         )
         return [
-            (Entity(**result["entity"]), abs(result["_distance"]))
+            (Entity.model_construct(**result["entity"]), abs(result["_distance"]))
             for result in entities_results
         ]
 
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Tuple
@@ -6,6 +7,7 @@ from spacy.language import Language
 from spacy.tokens import Doc, Span
 
 from spacy_lancedb_linker.kb import AnnKnowledgeBase
+from spacy_lancedb_linker.types import Alias, Entity
 
 
 @dataclass
@@ -39,40 +41,74 @@ class AnnLinker:
 
         # TODO: have a configurable set on mentions
         mentions = doc.ents
-        batch_candidates = self.kb.get_candidates_batch(mentions)
 
+        # embed all mentions in one batched encoder pass; sentence contexts
+        # are embedded lazily by the kb only when disambiguation needs them
+        mention_vectors = self.kb._embed_many([ent.text for ent in mentions])
+        batch_candidates = self.kb.get_candidates_batch(
+            mentions, vectors=mention_vectors
+        )
+
+        tasks = []
         for ent, alias_candidates in zip(doc.ents, batch_candidates):
             ent._.alias_candidates = alias_candidates
-
-            if len(alias_candidates) == 0:
-                continue
-            else:
-                candidate_entities = self.kb._aliases_to_entities(alias_candidates)
-
-                # TODO: have a configurable context (e.g. -1/+1 sentence)
-                context_embedding = self.kb._embed(ent.sent)
-
-                kb_candidates = self.kb.disambiguate(
-                    candidate_entities, context_embedding, ent.text
+            if len(alias_candidates):
+                tasks.append((ent, alias_candidates))
+
+        if not tasks:
+            return doc
+
+        # make sure the FTS index exists before fanning out, so workers
+        # don't race to build it through disambiguate's lazy finalize
+        self.kb.finalize()
+
+        # resolve mentions concurrently: LanceDB searches and the torch
+        # forward pass release the GIL, so independent mentions overlap.
+        # doc mutations happen on the main thread below to avoid races.
+        with ThreadPoolExecutor(max_workers=min(8, len(tasks))) as executor:
+            futures = [
+                executor.submit(
+                    self._resolve, alias_candidates, ent.sent.text, ent.text
                 )
+                for ent, alias_candidates in tasks
+            ]
+            resolved = [future.result() for future in futures]
+
+        for (ent, _alias_candidates), kb_candidates in zip(tasks, resolved):
+            ent._.kb_candidates = kb_candidates
+
+            if self.use_disambiguation_threshold:
+                filtered_results = [
+                    (entity, cosine_score)
+                    for entity, cosine_score in kb_candidates
+                    if cosine_score < self.kb.max_distance
+                ]
+            else:
+                filtered_results = kb_candidates
 
-                ent._.kb_candidates = kb_candidates
-
-                if self.use_disambiguation_threshold:
-                    filtered_results = [
-                        (entity, cosine_score)
-                        for entity, cosine_score in kb_candidates
-                        if cosine_score < self.kb.max_distance
-                    ]
-                else:
-                    filtered_results = kb_candidates
-
-                if len(filtered_results):
-                    best_candidate = filtered_results[0][0]
-                    for token in ent:
-                        token.ent_kb_id_ = best_candidate.entity_id
+            if len(filtered_results):
+                best_candidate = filtered_results[0][0]
+                for token in ent:
+                    token.ent_kb_id_ = best_candidate.entity_id
         return doc
 
+    def _resolve(
+        self,
+        alias_candidates: list[tuple[Alias, float]],
+        context_text: str,
+        mention_text: str,
+    ) -> list[tuple[Entity, float]]:
+        """Resolve one mention's alias candidates to ranked kb candidates."""
+        candidate_entities = self.kb._aliases_to_entities(alias_candidates)
+
+        if len(candidate_entities) == 1:
+            # unambiguous alias: a point-lookup replaces the whole
+            # FTS + vector-search disambiguation round trip
+            entity = self.kb.get_entity_by_id(candidate_entities[0])
+            return [(entity, 0.0)] if entity else []
+        # TODO: have a configurable context (e.g. -1/+1 sentence)
+        return self.kb.disambiguate(candidate_entities, context_text, mention_text)
+
     def set_kb(self, kb: AnnKnowledgeBase) -> None:
         """Set the KnowledgeBase."""
         self.kb = kb
@@ -89,5 +125,3 @@ class AnnLinker:
 @Language.factory("ann_linker")
 def create_ann_linker(nlp: Language, name: str) -> AnnLinker:
     return AnnLinker()
-    return AnnLinker()
-    return AnnLinker()
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 import pytest
 import spacy
 import srsly
@@ -35,20 +37,22 @@ def kb(entities: list[Entity], aliases: list[Alias]) -> AnnKnowledgeBase:
 
 
 def test_kb(kb: AnnKnowledgeBase):
+    # alias scores are compared approximately: the in-memory fast path and
+    # LanceDB's cosine kernel agree only up to float32 rounding
     assert kb.get_alias_candidates("ML") == [
         (
             Alias(alias="ML", entities=["a1", "a2"], probabilities=[0.5, 0.5]),
-            1.1920928955078125e-07,
+            pytest.approx(0.0, abs=1e-6),
         )
     ]
 
     candidate_entities = kb.get_entity_candidates("ML")
     assert sorted(candidate_entities) == ["a1", "a2"]
 
-    doc_embedding = kb._embed(
+    context = (
         "Linear regression is one of the first statistical models used by students of ML"
     )
-    assert kb.disambiguate(candidate_entities, doc_embedding, "ML") == [
+    assert kb.disambiguate(candidate_entities, context, "ML") == [
         (
             Entity(
                 entity_id="a1",
@@ -72,12 +76,43 @@ def test_kb(kb: AnnKnowledgeBase):
     assert kb.get_alias_candidates("learning") == [
         (
             Alias(alias="Machine learning", entities=["a1"], probabilities=[1.0]),
-            0.3687775135040283,
+            pytest.approx(0.3687775135040283, abs=1e-6),
         )
     ]
     assert kb.get_alias_candidates("Machine") == []
 
 
+def test_fingerprint_skips_reembedding(
+    tmp_path: Path, entities: list[Entity], aliases: list[Alias]
+):
+    uri = str(tmp_path / "lancedb")
+    cold = AnnKnowledgeBase(uri=uri)
+    cold.add_entities(entities)
+    cold.add_aliases(aliases)
+
+    # same inputs on a fresh instance over the same uri: nothing is re-embedded
+    warm = AnnKnowledgeBase(uri=uri)
+    calls: list[list[str]] = []
+    embed_many = warm._embed_many
+
+    def counting_embed_many(
+        texts: list[str], batch_size: int = 64
+    ) -> list[list[float]]:
+        calls.append(texts)
+        return embed_many(texts, batch_size)
+
+    warm._embed_many = counting_embed_many
+    warm.add_entities(entities)
+    warm.add_aliases(aliases)
+    assert calls == []
+    assert sorted(warm.get_entity_candidates("ML")) == ["a1", "a2"]
+
+    # changing a row while keeping the same entity_id must trigger a rebuild
+    changed = [entities[0].model_copy(update={"description": "changed"})] + entities[1:]
+    warm.add_entities(changed)
+    assert len(calls) == 1
+
+
 def test_linker(nlp: Language, kb: AnnKnowledgeBase, aliases: list[Alias]):
     # given
     ruler = nlp.add_pipe("entity_ruler")
@@ -98,14 +133,17 @@ def test_linker(nlp: Language, kb: AnnKnowledgeBase, aliases: list[Alias]):
     # then
     assert ent_nlp.kb_id_ == "a3"
     assert ent_nlp._.alias_candidates == [
-        (Alias(alias="NLP", entities=["a3", "a4"], probabilities=[0.5, 0.5]), 0.0),
+        (
+            Alias(alias="NLP", entities=["a3", "a4"], probabilities=[0.5, 0.5]),
+            pytest.approx(0.0, abs=1e-6),
+        ),
         (
             Alias(
                 alias="Natural language processing",
                 entities=["a3"],
                 probabilities=[1.0],
             ),
-            0.39776819944381714,
+            pytest.approx(0.39776819944381714, abs=1e-6),
         ),
     ]
     assert ent_nlp._.kb_candidates == [
@@ -132,7 +170,7 @@ def test_linker(nlp: Language, kb: AnnKnowledgeBase, aliases: list[Alias]):
     assert ent_ml._.alias_candidates == [
         (
             Alias(alias="Machine learning", entities=["a1"], probabilities=[1.0]),
-            0.15205204486846924,
+            pytest.approx(0.15205204486846924, abs=1e-6),
         )
     ]
     assert ent_ml._.kb_candidates == [